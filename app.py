@@ -1,12 +1,17 @@
 # Import the necessary modules.
 import os
-from flask import Flask, render_template, request, flash, redirect, session, g, url_for
+from flask import Flask, render_template, request, flash, redirect, session, g, url_for, abort
 from flask_debugtoolbar import DebugToolbarExtension
+from flask_caching import Cache
+from flask_caching.backends import NullCache
+from sqlalchemy import delete, func
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import joinedload, make_transient_to_detached, raiseload, selectinload
 import pdb
 from flask_migrate import Migrate
 from forms import UserAddForm, LoginForm, MessageForm
-from models import db, connect_db, User, Message, Likes
+from models import db, connect_db, User, Message, Follows, Likes
 
 # Define a key to get the current user's ID out of the session.
 CURR_USER_KEY = "curr_user"
@@ -27,9 +32,40 @@ app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = True
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', "it's a secret")
 app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = False
 
+# Set the bcrypt work factor for password hashes explicitly (2**12 rounds unless BCRYPT_LOG_ROUNDS is set).
+app.config['BCRYPT_LOG_ROUNDS'] = int(os.environ.get('BCRYPT_LOG_ROUNDS', 12))
+
+# Configure the database connection pool.
+# Each gunicorn worker (see gunicorn.conf.py) serves GUNICORN_THREADS requests at once,
+# so the pool keeps a connection for each of them plus a couple to spare, and opens no overflow connections:
+# every worker's pool counts against Postgres' max_connections (see gunicorn.conf.py).
+# Connections are kept open and reused across requests instead of reconnecting each time,
+# recycled after an hour, and checked with a cheap ping before use so stale ones are replaced.
+# Statements run with many parameter sets (like the bulk inserts in seed.py) are sent in batches
+# instead of one round-trip per row: INSERTs as multi-row VALUES, UPDATEs and DELETEs with execute_batch.
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+    'pool_size': int(os.environ.get('GUNICORN_THREADS', 8)) + 2,
+    'max_overflow': 0,
+    'pool_timeout': 30,
+    'pool_recycle': 3600,
+    'pool_pre_ping': True,
+    'executemany_mode': 'values_plus_batch',
+}
+
+# Configure the cache used to keep the logged in user between requests.
+# It uses Redis when REDIS_URL is set. Without it nothing is cached (NullCache), since a cache kept inside
+# one worker process would miss the invalidations made by the other workers.
+app.config['CACHE_TYPE'] = os.environ.get(
+    'CACHE_TYPE', 'RedisCache' if os.environ.get('REDIS_URL') else 'NullCache')
+app.config['CACHE_REDIS_URL'] = os.environ.get('REDIS_URL', 'redis://localhost:6379/0')
+app.config['CACHE_DEFAULT_TIMEOUT'] = 300
+
 # Initialize the DebugToolbarExtension with the app.
 toolbar = DebugToolbarExtension(app)
 
+# Initialize the Cache extension with the app.
+cache = Cache(app)
+
 # Call the connect_db function and pass in the app.
 # This function sets up the connection to the database.
 connect_db(app)
@@ -38,22 +74,178 @@ connect_db(app)
 # This connects the app and the db and allows running migrations.
 migrate = Migrate(app, db)
 
+# This function gets a row by its primary key with Session.get, which checks the identity map
+# before going to the database, and aborts with a 404 if there is no such row.
+# When loader options are given, the row is loaded with populate_existing, since Session.get returns
+# a row that is already in the session as it is, without applying the options. That re-selects a row
+# that is already loaded, so pages showing g.user use get_detail_user_or_404 instead.
+def get_or_404(model, ident, **kwargs):
+    """Get a `model` row by primary key, or abort with a 404."""
+    if kwargs.get('options'):
+        kwargs.setdefault('populate_existing', True)
+    instance = db.session.get(model, ident, **kwargs)
+    if instance is None:
+        abort(404)
+    return instance
+
+# These are the loader options for pages that show the profile header (users/detail.html).
+# The header counts the user's following, followers and likes, so those are loaded up front,
+# and raiseload('*') turns any other lazy load on the user into an error instead of a silent extra query.
+# Their messages are counted in SQL instead (see count_messages), since a user can have thousands.
+USER_DETAIL_RELATIONSHIPS = ('following', 'followers', 'likes')
+USER_DETAIL_OPTIONS = [
+    *[selectinload(getattr(User, relationship)) for relationship in USER_DETAIL_RELATIONSHIPS],
+    raiseload('*'),
+]
+
+# This function gets the user for a page that shows the profile header, or aborts with a 404.
+# On the logged in user's own pages, the user is g.user, which is already in the session, so the header's
+# relationships are loaded onto it (one query each, like selectinload) instead of selecting its row again.
+def get_detail_user_or_404(user_id):
+    """Get a user with everything the profile header shows."""
+    if user_id == g.user.id:
+        for relationship in USER_DETAIL_RELATIONSHIPS:
+            getattr(g.user, relationship)
+        return g.user
+    return get_or_404(User, user_id, options=USER_DETAIL_OPTIONS)
+
+# This function counts a user's messages for the profile header, without loading them.
+def count_messages(user_id):
+    """Count the messages posted by a user."""
+    return db.session.query(func.count(Message.id)).filter_by(user_id=user_id).scalar()
+
+# These are the user columns kept in the cache for g.user.
+# The password hash is left out; the routes that check a password load it from the database.
+CACHED_USER_COLUMNS = ('id', 'username', 'email', 'image_url', 'header_image_url', 'bio', 'location')
+
+# These functions read from, write to and delete from the cache. Any cache error (like Redis being down)
+# is logged and treated as a miss, so the request falls back to the database instead of failing.
+def cache_get(key):
+    """Get `key` from the cache, or None if it's missing or the cache fails."""
+    try:
+        return cache.get(key)
+    except Exception:
+        app.logger.exception("Cache get failed for %s", key)
+        return None
+
+def cache_set(key, value):
+    """Put `value` in the cache under `key`, ignoring cache failures."""
+    try:
+        cache.set(key, value)
+    except Exception:
+        app.logger.exception("Cache set failed for %s", key)
+
+def cache_delete(*keys):
+    """Delete `keys` from the cache, ignoring cache failures."""
+    try:
+        cache.delete_many(*keys)
+    except Exception:
+        app.logger.exception("Cache delete failed for %s", keys)
+
+# This function tells whether a real cache backend is configured (NullCache is the default, see above).
+def user_cache_enabled():
+    """Is there a cache to keep g.user in between requests?"""
+    return not isinstance(cache.cache, NullCache)
+
+# This function saves a user's own columns and the IDs of the users they follow (user.following_ids)
+# and of the messages they liked (user.liked_ids) in the cache, never other users' or messages' rows,
+# so a page never shows a stale cached copy of someone else.
+def store_cached_user(user):
+    """Put `user` in the cache."""
+    cache_set(f"user:{user.id}", {
+        'columns': {column: getattr(user, column) for column in CACHED_USER_COLUMNS},
+        'following_ids': list(user.following_ids),
+        'liked_ids': list(user.liked_ids),
+    })
+
+# This function gets a user for g.user, first looking in the cache.
+# On a hit, the user is attached to this request's session with merge(load=False), which trusts the cached
+# columns instead of querying for them again, and their IDs are set from the cache; their relationships
+# load from the database if a page uses them.
+# On a miss, it loads the user from the database. With a cache configured, it also loads their IDs
+# and caches them for the next request; without one, the IDs are only loaded if the page uses them.
+def get_cached_user(user_id):
+    """Get a user from the cache or the database."""
+    data = cache_get(f"user:{user_id}")
+    if data is not None:
+        user = User(**data['columns'])
+        make_transient_to_detached(user)
+        user = db.session.merge(user, load=False)
+        user.following_ids = data['following_ids']
+        user.liked_ids = data['liked_ids']
+        return user
+    user = db.session.get(User, user_id)
+    if user is not None and user_cache_enabled():
+        store_cached_user(user)
+    return user
+
+# This function applies a change to g.user's IDs (like following a user) and saves it in the cached copy,
+# instead of dropping the cached copy, so the next request doesn't have to load the IDs again.
+# Without a cache nothing is kept between requests, so there's nothing to update.
+def update_cached_user(change):
+    """Apply `change` to g.user and save the result in the cache."""
+    if user_cache_enabled():
+        change(g.user)
+        store_cached_user(g.user)
+
+# This function drops the cached copies of the given users.
+# Call it whenever a user's own columns change, or when other users' IDs change (like a deleted message they liked).
+def invalidate_cached_user(*user_ids):
+    """Drop cached users so the next request reloads them from the database."""
+    if user_ids:
+        cache_delete(*[f"user:{user_id}" for user_id in user_ids])
+
+# This function decides when a page can't be served from (or saved to) the page cache.
+# Pages for logged in users show their own data, and pages with flash messages waiting
+# would show those messages to everyone, so only plain anonymous pages are shared.
+def skip_page_cache():
+    """Is this request personalized, so its page can't be shared through the cache?"""
+    return g.user is not None or '_flashes' in session
+
+# This function builds the page cache key for the users list.
+# The key includes the search term, and a version number that invalidate_users_list bumps.
+def users_list_cache_key():
+    """Cache key for the users list page."""
+    version = cache_get("users_list_version") or 0
+    return f"view/users/{version}/{request.args.get('q', '')}"
+
+# This function makes every cached users list page (for every search term) stale.
+# Call it whenever a user is added, edited or deleted.
+def invalidate_users_list():
+    """Drop cached users list pages."""
+    try:
+        cache.cache.inc("users_list_version")
+    except Exception:
+        app.logger.exception("Cache inc failed for users_list_version")
+
+# This decorator marks a view that never needs the current user, like the login and signup forms.
+# add_user_to_g skips the user lookup for these views.
+def no_auth(view):
+    """Mark a view as not needing g.user loaded."""
+    view._no_auth = True
+    return view
+
 # Use this decorator to make this function run before every request.
-# Check if the current user's ID is in the session.
-# If it is, get that user from the database and set it on g.user.
+# Static files, unknown URLs and views marked with @no_auth don't need the current user,
+# so g.user is set to None for them without looking anything up.
+# Otherwise, check if the current user's ID is in the session.
+# If it is, get that user (from the cache when possible) and set it on g.user.
 # If it's not, set g.user to None.
 @app.before_request
 def add_user_to_g():
     """If a user is logged in, add the current user to Flask global."""
+    g.user = None
+    if (request.endpoint in ('static', None)
+            or getattr(app.view_functions.get(request.endpoint), '_no_auth', False)):
+        return
     if CURR_USER_KEY in session:
-        g.user = User.query.get(session[CURR_USER_KEY])
-    else:
-        g.user = None
+        g.user = get_cached_user(session[CURR_USER_KEY])
 
 # This function logs in a user.
 # It does this by adding the user's ID to the session.
 def do_login(user):
     """Log in a user."""
+    invalidate_cached_user(user.id)
     session[CURR_USER_KEY] = user.id
 
 # This function logs out a user.
@@ -61,6 +253,7 @@ def do_login(user):
 def do_logout():
     """Logout a user."""
     if CURR_USER_KEY in session:
+        invalidate_cached_user(session[CURR_USER_KEY])
         del session[CURR_USER_KEY]
 
 # This is a route for signing up a user.
@@ -68,6 +261,7 @@ def do_logout():
 # If the username is already taken, I flash a message and re-render the form.
 # If the form doesn't validate, I just render the form.
 @app.route('/signup', methods=["GET", "POST"])
+@no_auth
 def signup():
     """Handle user signup."""
     form = UserAddForm()
@@ -83,6 +277,7 @@ def signup():
         except IntegrityError:
             flash("Username already taken", 'danger')
             return render_template('users/signup.html', form=form)
+        invalidate_users_list()
         do_login(user)
         return redirect("/")
     else:
@@ -93,6 +288,7 @@ def signup():
 # If the user is authenticated, I log them in and redirect them to the homepage.
 # If the user isn't authenticated, I flash a message and re-render the form.
 @app.route('/login', methods=["GET", "POST"])
+@no_auth
 def login():
     """Handle user login."""
     form = LoginForm()
@@ -111,25 +307,36 @@ def login():
 @app.route('/logout')
 def logout():
     """Handle logout of user."""
+    if g.user:
+        invalidate_cached_user(g.user.id)
     User.logout()
     flash("You have successfully logged out. See you later!", "success")
     return redirect('/')
 
 # This is a route for listing all users.
-# If a 'q' parameter is provided in the query string, filters the users by that username.
+# If a 'q' parameter is provided in the query string, filters the users by that username (ignoring case),
+# showing at most 50 matches. The trigram index on usernames lets Postgres find them without scanning every user.
 # Then renders a template with the list of users.
+# Anonymous visitors all see the same page, so it is cached for a minute per search term.
 @app.route('/users')
+@cache.cached(timeout=60, key_prefix=users_list_cache_key, unless=skip_page_cache)
 def list_users():
     """Page with listing of users."""
     search = request.args.get('q')
     if not search:
         users = User.query.all()
     else:
-        users = User.query.filter(User.username.like(f"%{search}%")).all()
+        users = (User
+                 .query
+                 .filter(User.username.ilike(f"%{search}%"))
+                 .order_by(User.username)
+                 .limit(50)
+                 .all())
     return render_template('users/index.html', users=users)
 
 # This is a route for showing a user's profile.
-# Gets the user by their ID and gets their messages.
+# Gets the user by their ID along with everything the profile header shows, and counts their messages.
+# Then gets their 100 most recent messages, which the index on (user_id, timestamp DESC) returns in order.
 # Then renders a template with the user and their messages.
 @app.route('/users/<int:user_id>')
 def users_show(user_id):
@@ -137,39 +344,45 @@ def users_show(user_id):
     if not g.user:
         flash("Access unauthorized.", "danger")
         return redirect("/", 403)
-    user = User.query.get_or_404(user_id)
+    user = get_detail_user_or_404(user_id)
     messages = (Message
                 .query
-                .filter(Message.user_id == user_id)
+                .filter_by(user_id=user_id)
                 .order_by(Message.timestamp.desc())
                 .limit(100)
                 .all())
-    return render_template('users/show.html', user=user, messages=messages)
+    return render_template('users/show.html', user=user, messages=messages,
+                           num_messages=count_messages(user_id))
 
 # This is a route for showing who a user is following.
-# Gets the user by their ID and then renders a template with the user.
+# Gets the user by their ID (with everything the profile header shows), counts their messages,
+# and then renders a template with the user.
 @app.route('/users/<int:user_id>/following')
 def show_following(user_id):
     """Show list of people this user is following."""
     if not g.user:
         flash("Access unauthorized.", "danger")
         return redirect("/")
-    user = User.query.get_or_404(user_id)
-    return render_template('users/following.html', user=user)
+    user = get_detail_user_or_404(user_id)
+    return render_template('users/following.html', user=user, num_messages=count_messages(user_id))
 
 # This is a route for showing a user's followers.
-# Gets the user by their ID and then renders a template with the user.
+# Gets the user by their ID (with everything the profile header shows), counts their messages,
+# and then renders a template with the user.
 @app.route('/users/<int:user_id>/followers')
 def users_followers(user_id):
     """Show list of followers of this user."""
     if not g.user:
         flash("Access unauthorized.", "danger")
         return redirect("/")
-    user = User.query.get_or_404(user_id)
-    return render_template('users/followers.html', user=user)
+    user = get_detail_user_or_404(user_id)
+    return render_template('users/followers.html', user=user, num_messages=count_messages(user_id))
 
 # This is a route for adding a follow for the currently logged in user.
-# Gets the user to be followed by their ID, adds them to the current user's following list, and then commits the session.
+# Inserts the follows row directly by ID, commits the session, and adds the ID to g.user's cached following IDs.
+# Inserting the row (instead of appending to g.user.following) doesn't need the following list loaded,
+# and following someone twice is a no-op.
+# If the user to be followed doesn't exist, the foreign key rejects the row, so flashes an error message instead.
 # Then redirects to the page showing who the current user is following.
 @app.route('/users/follow/<int:follow_id>', methods=['POST'])
 def add_follow(follow_id):
@@ -177,13 +390,23 @@ def add_follow(follow_id):
     if not g.user:
         flash("Access unauthorized.", "danger")
         return redirect("/")
-    followed_user = User.query.get_or_404(follow_id)
-    g.user.following.append(followed_user)
-    db.session.commit()
+    try:
+        db.session.execute(
+            insert(Follows)
+            .values(user_being_followed_id=follow_id, user_following_id=g.user.id)
+            .on_conflict_do_nothing()
+        )
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        flash("User not found.", "danger")
+        return redirect(f"/users/{g.user.id}/following")
+    update_cached_user(lambda user: user.following_ids.add(follow_id))
     return redirect(f"/users/{g.user.id}/following")
 
 # This is a route for having the currently logged in user stop following another user.
-# Gets the user to be unfollowed by their ID, removes them from the current user's following list, and then commits the session.
+# Deletes the follows row directly (no need to load the following list), commits the session,
+# and removes the ID from g.user's cached following IDs.
 # Then redirects to the page showing who the current user is following.
 @app.route('/users/stop-following/<int:follow_id>', methods=['POST'])
 def stop_following(follow_id):
@@ -191,14 +414,20 @@ def stop_following(follow_id):
     if not g.user:
         flash("Access unauthorized.", "danger")
         return redirect("/")
-    followed_user = User.query.get(follow_id)
-    g.user.following.remove(followed_user)
+    db.session.execute(
+        delete(Follows)
+        .where(Follows.user_being_followed_id == follow_id,
+               Follows.user_following_id == g.user.id)
+    )
     db.session.commit()
+    update_cached_user(lambda user: user.following_ids.discard(follow_id))
     return redirect(f"/users/{g.user.id}/following")
 
 # This is a route for updating the profile of the current user.
 # If the user is not logged in, flashes an error message and redirects to the homepage.
-# Gets the current user from the database and creates a form with their data.
+# Uses the current user (already loaded on g.user) and creates a form with their cached columns,
+# which leave out the password hash, so the password field starts empty and the hash isn't loaded.
+# The number of messages they liked comes from g.user.liked_ids, which the cache already holds when there is one.
 # If the form validates, authenticates the user with their current username and the password from the form.
 # If the user is authenticated, updates their data and commits the session.
 # Then redirects to the user's profile page.
@@ -210,9 +439,9 @@ def profile():
     if not g.user:
         flash("Access unauthorized.", "danger")
         return redirect("/")
-    user = User.query.get_or_404(g.user.id)
-    form = UserAddForm(obj=user)
-    num_liked_messages = len(user.likes)
+    user = g.user
+    form = UserAddForm(data={column: getattr(user, column) for column in CACHED_USER_COLUMNS})
+    num_liked_messages = len(user.liked_ids)
     if form.validate_on_submit():
         if User.authenticate(user.username, form.password.data):
             user.username = form.username.data
@@ -222,6 +451,8 @@ def profile():
             user.bio = form.bio.data
             user.location = form.location.data
             db.session.commit()
+            invalidate_cached_user(user.id)
+            invalidate_users_list()
             return redirect(f"/users/{user.id}")
         else:
             flash("Invalid password, please try again.", "danger")
@@ -237,9 +468,12 @@ def delete_user():
     if not g.user:
         flash("Access unauthorized.", "danger")
         return redirect("/")
+    # Users who follow this user have their ID cached in their following_ids.
+    invalidate_cached_user(g.user.id, *[u.id for u in g.user.followers])
     do_logout()
     db.session.delete(g.user)
     db.session.commit()
+    invalidate_users_list()
     return redirect("/signup")
 
 # This is a route for adding a message.
@@ -259,7 +493,7 @@ def messages_add():
         flash("Access unauthorized.", "danger")
         return redirect("/", code=401)
     user_id = session[CURR_USER_KEY]
-    user = User.query.get(user_id)
+    user = db.session.get(User, user_id)
     if not user:
         flash("Access unauthorized.", "danger")
         return redirect("/", code=401)
@@ -272,16 +506,16 @@ def messages_add():
     return render_template('messages/new.html', form=form)
 
 # This is a route for showing a message.
-# Get the message by its ID and render it in a template.
+# Get the message by its ID (or 404 if there isn't one) and render it in a template.
 @app.route('/messages/<int:message_id>', methods=["GET"])
 def messages_show(message_id):
     """Show a message."""
-    msg = Message.query.get(message_id)
+    msg = get_or_404(Message, message_id)
     return render_template('messages/show.html', message=msg)
 
 # This is a route for deleting a message.
 # If the user is not logged in, flash an error message and redirect to the homepage.
-# Get the message by its ID.
+# Get the message by its ID, or 404 if there isn't one.
 # If the message's user ID is not the same as the current user's ID, flash an error message and redirect to the homepage.
 # Delete the message from the database and commit the session.
 # Then redirect to the user's profile page.
@@ -291,19 +525,25 @@ def messages_destroy(message_id):
     if not g.user:
         flash("Access unauthorized.", "danger")
         return redirect("/", 403)
-    msg = Message.query.get(message_id)
+    msg = get_or_404(Message, message_id)
     if msg.user_id != g.user.id:
         flash("Access unauthorized.", "danger")
         return redirect("/", 403)
+    # Users who liked this message have its ID cached in their liked_ids.
+    invalidate_cached_user(*[u.id for u in msg.user_likes])
     db.session.delete(msg)
     db.session.commit()
     return redirect(f"/users/{g.user.id}")
 
 # This is a route for the homepage.
-# If the user is logged in, get the IDs of the users they are following and their own ID.
-# Then get the 100 most recent messages from those users and render them in a template.
+# If the user is logged in, get the IDs of the users they are following (g.user.following_ids) and their own ID.
+# Then get the 100 most recent messages from those users, with their authors joined in,
+# and count the user's messages and followers (both in one query) for the sidebar, instead of loading those rows.
+# Render them in a template, along with the set of message IDs the user has liked.
 # If the user is not logged in, render a different template.
+# The anonymous homepage is the same for everyone, so it is cached for a minute.
 @app.route('/')
+@cache.cached(timeout=60, unless=skip_page_cache)
 def homepage():
     """Show homepage:
 
@@ -312,27 +552,31 @@ def homepage():
     """
     
     if g.user:
-        following_ids = [u.id for u in g.user.following]
-        following_ids.append(g.user.id)
+        following_ids = [*g.user.following_ids, g.user.id]
         messages = (Message
                     .query
+                    .options(joinedload(Message.user))
                     .filter(Message.user_id.in_(following_ids))
                     .order_by(Message.timestamp.desc())
                     .limit(100)
                     .all())
-
-        return render_template('home.html', messages=messages)
+        num_messages, num_followers = db.session.query(
+            db.session.query(func.count(Message.id)).filter_by(user_id=g.user.id).scalar_subquery(),
+            db.session.query(func.count()).select_from(Follows).filter_by(user_being_followed_id=g.user.id).scalar_subquery(),
+        ).one()
+        return render_template('home.html', messages=messages, liked_ids=g.user.liked_ids,
+                               num_messages=num_messages, num_followers=num_followers)
 
     else:
         return render_template('home-anon.html')
 
 # This is a route for toggling a like for a message for the current user.
 # If the user is not logged in, flash an error message and redirect to the homepage.
-# Get the message by its ID.
-# Check if the user has already liked the message.
-# If they have, remove the like.
-# If they haven't, add a new like.
-# Commit the session and redirect to the referrer URL or the homepage if the referrer URL is not set.
+# Try to add a new like; the unique constraint on (user_id, message_id) means nothing is
+# inserted if the user has already liked the message, and in that case remove the like instead.
+# If the message doesn't exist, the foreign key rejects the like and the response is a 404.
+# Commit the session, add or remove the message ID in g.user's cached liked IDs,
+# and redirect to the referrer URL or the homepage if the referrer URL is not set.
 @app.route('/users/toggle_like/<int:msg_id>', methods=['POST'])
 def toggle_like(msg_id):
     """Toggle a liked message for the currently-logged-in user."""
@@ -341,27 +585,36 @@ def toggle_like(msg_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    message = Message.query.get_or_404(msg_id)
-
-    like = Likes.query.filter_by(user_id=g.user.id, message_id=message.id).first()
-
-    if like:
+    try:
+        new_like_id = db.session.execute(
+            insert(Likes)
+            .values(user_id=g.user.id, message_id=msg_id)
+            .on_conflict_do_nothing(index_elements=['user_id', 'message_id'])
+            .returning(Likes.id)
+        ).scalar()
+    except IntegrityError:
+        db.session.rollback()
+        abort(404)
+
+    if new_like_id is None:
         # If the user has already liked the message, remove the like
-        db.session.delete(like)
+        db.session.execute(
+            delete(Likes)
+            .where(Likes.user_id == g.user.id, Likes.message_id == msg_id)
+        )
+        db.session.commit()
+        update_cached_user(lambda user: user.liked_ids.discard(msg_id))
     else:
-        # If the user hasn't liked the message, add a new like
-        new_like = Likes(user_id=g.user.id, message_id=message.id)
-        db.session.add(new_like)
-
-    db.session.commit()
+        db.session.commit()
+        update_cached_user(lambda user: user.liked_ids.add(msg_id))
 
     # Redirect to the referrer URL if it's set, otherwise redirect to the home page
     return redirect(request.referrer or url_for('homepage'))
     
 # This is a route for showing the messages a user has liked.
 # If the user is not logged in, flash an error message and redirect to the homepage.
-# Get the user by their ID and their liked messages.
-# Render a template with the user and their liked messages.
+# Get the user by their ID, count their messages, and get their liked messages (with their authors, in one extra query).
+# Render a template with the user, their liked messages and the set of message IDs the current user has liked.
 @app.route('/users/<int:user_id>/likes')
 def show_likes(user_id):
     """Show list of liked messages for a user."""
@@ -370,18 +623,41 @@ def show_likes(user_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
     
-    user = User.query.get_or_404(user_id)
-    messages = user.likes
-    return render_template('users/likes.html', user=user, messages=messages)
+    user = get_or_404(User, user_id)
+    messages = (Message
+                .query
+                .options(selectinload(Message.user))
+                .join(Likes, Likes.message_id == Message.id)
+                .filter(Likes.user_id == user_id)
+                .all())
+    return render_template('users/likes.html', user=user, messages=messages, liked_ids=g.user.liked_ids,
+                           num_messages=count_messages(user_id))
 
 # This is a function that is run after every request.
-# It adds headers to the response that prevent caching.
+# It adds caching headers to the response.
+# Static files can be cached by browsers and proxies for a day. Their URLs aren't versioned,
+# so they aren't marked immutable; a changed file is picked up once the day is up.
+# The anonymous homepage is the same for everyone, so it can be cached publicly for a minute,
+# unless this response changes the session cookie. It varies on the cookie, so a shared cache
+# doesn't hand the anonymous page to a logged in user.
+# Every other page may show the logged in user's data, so it must not be cached.
 @app.after_request
 def add_header(req):
-    """Add non-caching headers on every request."""
+    """Add caching headers on every request."""
+
+    if request.endpoint == 'static':
+        req.headers['Cache-Control'] = 'public, max-age=86400'
+        return req
+
+    if (request.endpoint == 'homepage'
+            and g.get('user') is None
+            and '_flashes' not in session
+            and not session.modified):
+        req.headers['Cache-Control'] = 'public, max-age=60'
+        req.vary.add('Cookie')
+        return req
 
     req.headers["Cache-Control"] = "no-cache, no-store, must-revalidate"
     req.headers["Pragma"] = "no-cache"
     req.headers["Expires"] = "0"
-    req.headers['Cache-Control'] = 'public, max-age=0'
-    return req
\ No newline at end of file
+    return req
@@ -0,0 +1,200 @@
+"""Shared pytest fixtures for the Warbler tests."""
+
+import os
+from contextlib import contextmanager
+
+import pytest
+from sqlalchemy import create_engine, event, insert, text
+from sqlalchemy.pool import NullPool, StaticPool
+
+# When the tests run in parallel (pytest -n auto, with pytest-xdist), each worker process
+# gets its own database, so workers never see each other's tables or rows.
+XDIST_WORKER = os.environ.get('PYTEST_XDIST_WORKER')
+TEST_DATABASE = f"warbler-test-{XDIST_WORKER}" if XDIST_WORKER else "warbler-test"
+
+
+# This function connects to the "postgres" maintenance database on the same server.
+# CREATE/DROP DATABASE can't run inside a transaction, so the connection autocommits.
+@contextmanager
+def _server_connection():
+    """Connect to the Postgres server in autocommit mode."""
+
+    engine = create_engine("postgresql:///postgres", isolation_level="AUTOCOMMIT", poolclass=NullPool)
+    with engine.connect() as connection:
+        yield connection
+
+
+# BEFORE we import our app, point it at the test database, turn off the user cache,
+# and use the lowest bcrypt work factor so hashing test passwords is cheap
+# (we need to do this before we import our app, since that will have already
+# read its config).
+os.environ['DATABASE_URL'] = f"postgresql:///{TEST_DATABASE}"
+os.environ['CACHE_TYPE'] = "NullCache"
+os.environ['BCRYPT_LOG_ROUNDS'] = "4"
+
+from app import app, CURR_USER_KEY
+from models import db, bcrypt, User
+
+# Don't wait for each commit to be flushed to disk: test data is thrown away anyway.
+# (The tests stay on Postgres rather than SQLite, since the app uses Postgres-only SQL
+# like INSERT ... ON CONFLICT and timezone('utc', now()).)
+# The tests run in one thread, so they share a single connection for the whole run (StaticPool)
+# instead of checking connections in and out of a pool. The pool size, recycle and pre-ping settings
+# don't apply to it: the one connection is never recycled or pinged, so they're left out.
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+    **{
+        key: value for key, value in app.config['SQLALCHEMY_ENGINE_OPTIONS'].items()
+        if key not in ('pool_size', 'max_overflow', 'pool_timeout', 'pool_recycle', 'pool_pre_ping')
+    },
+    'poolclass': StaticPool,
+    'connect_args': {'options': '-c synchronous_commit=off'},
+}
+
+# Hash the seed users' passwords once, when the test run starts.
+TESTUSER_PASSWORD_HASH = bcrypt.generate_password_hash("testpassword").decode('UTF-8')
+ANOTHERUSER_PASSWORD_HASH = bcrypt.generate_password_hash("anotherpassword").decode('UTF-8')
+
+
+# Create the tables once for the whole test run, instead of in every test's setUp (or when a test module is imported),
+# so running a few tests with `pytest -k` only pays for it if they run at all.
+# Any tables left over from an earlier run are dropped first, so the schema always matches the models.
+# Under pytest-xdist, this worker's database is created first if it doesn't exist yet.
+@pytest.fixture(scope="session", autouse=True)
+def _schema():
+    """Create the database schema once per test session."""
+
+    if XDIST_WORKER:
+        with _server_connection() as connection:
+            exists = connection.execute(
+                text("SELECT 1 FROM pg_database WHERE datname = :name"), {"name": TEST_DATABASE}
+            ).scalar()
+            if not exists:
+                connection.execute(text(f'CREATE DATABASE "{TEST_DATABASE}"'))
+
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+
+    yield
+
+    with app.app_context():
+        db.session.remove()
+        db.drop_all()
+
+    # Drop a worker's own database once its tests are done.
+    if XDIST_WORKER:
+        db.engine.dispose()
+        with _server_connection() as connection:
+            connection.execute(text(f'DROP DATABASE IF EXISTS "{TEST_DATABASE}"'))
+
+
+# Create the two users most tests need once for the whole run, instead of in every test's setUp.
+# Both rows go in with one multi-row INSERT ... RETURNING, instead of a signup and a flush per user.
+# Tests that change them should use db_session, so their changes are rolled back.
+@pytest.fixture(scope="session")
+def seed_users(_schema):
+    """Create testuser and anotheruser once per test session, and return their IDs."""
+
+    rows = [
+        dict(username="testuser", email="test@test.com", password=TESTUSER_PASSWORD_HASH),
+        dict(username="anotheruser", email="another@test.com", password=ANOTHERUSER_PASSWORD_HASH),
+    ]
+    ids = dict(db.session.execute(
+        insert(User).values(rows).returning(User.username, User.id)
+    ).all())
+    db.session.commit()
+    db.session.remove()
+
+    return (ids["testuser"], ids["anotheruser"])
+
+
+# Share one test client across all the tests, instead of building one per test.
+@pytest.fixture(scope="session")
+def _shared_client():
+    """Create the test client once per test session."""
+
+    return app.test_client()
+
+
+# Clear the shared client's cookies before handing it to a test, so each test starts logged out.
+@pytest.fixture
+def client(_shared_client):
+    """Give the test the shared test client, with no one logged in."""
+
+    _shared_client.cookie_jar.clear()
+    return _shared_client
+
+
+# Turn off CSRF protection in WTForms while a test module's tests run, and put it back afterwards,
+# so it doesn't leak into other test modules. View test modules opt in with pytestmark.
+@pytest.fixture(scope="module")
+def no_csrf():
+    """Disable CSRF protection for the tests in a module."""
+
+    prev = app.config.get('WTF_CSRF_ENABLED', True)
+    app.config['WTF_CSRF_ENABLED'] = False
+    yield
+    app.config['WTF_CSRF_ENABLED'] = prev
+
+
+# Log a test client out, by deleting the current user key from the session and sending a GET request to the logout route.
+# It's a plain function, like login_as in test_message_views.py; import it with `from conftest import logout`.
+def logout(client):
+    """Log a test client out."""
+    with client.session_transaction() as sess:
+        if CURR_USER_KEY in sess:
+            del sess[CURR_USER_KEY]
+    return client.get('/logout')
+
+
+# Run a test inside a transaction that is rolled back afterwards, so nothing it writes is kept
+# and there is nothing to delete before the next test.
+# db.session is swapped for a session bound to one connection with an open transaction and a SAVEPOINT.
+# The code under test can commit and roll back as usual: that only ends the SAVEPOINT, and a new one is started.
+@pytest.fixture
+def db_session():
+    """Give the test a db.session whose changes are all rolled back at the end."""
+
+    connection = db.engine.connect()
+    transaction = connection.begin()
+    nested = connection.begin_nested()
+
+    session = db.create_scoped_session(options={'bind': connection, 'binds': {}})
+
+    @event.listens_for(session, 'after_transaction_end')
+    def restart_savepoint(sess, trans):
+        nonlocal nested
+        if not nested.is_active:
+            nested = connection.begin_nested()
+
+    app_session = db.session
+    db.session = session
+
+    yield session
+
+    db.session = app_session
+    session.remove()
+    transaction.rollback()
+    connection.close()
+
+
+# Count the SQL statements the app runs, to catch pages that run a query per row (N+1 queries).
+# Use it like: `with count_queries() as queries: ...`, then check len(queries).
+@pytest.fixture
+def count_queries():
+    """Give the test a context manager that records the SQL statements run inside it."""
+
+    @contextmanager
+    def counter():
+        statements = []
+
+        def record(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        event.listen(db.engine, 'before_cursor_execute', record)
+        try:
+            yield statements
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', record)
+
+    return counter
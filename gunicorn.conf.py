@@ -0,0 +1,20 @@
+"""Gunicorn settings for Warbler.
+
+Run with `gunicorn app:app`; gunicorn picks this file up from the working directory.
+"""
+
+import os
+
+# Run several worker processes (4 unless WEB_CONCURRENCY is set), each serving requests on a pool of threads,
+# so requests waiting on the database overlap instead of queueing behind each other.
+# Each thread can hold a database connection, so workers x (threads + 2) (the pool size set in app.py)
+# must stay under Postgres' max_connections (100 by default), leaving room for migrations and psql.
+# The default of 4 x 10 = 40 does; raise WEB_CONCURRENCY only together with max_connections.
+workers = int(os.environ.get('WEB_CONCURRENCY', 4))
+worker_class = 'gthread'
+
+# The app sizes its database connection pool from the same variable, so every thread can get a connection.
+threads = int(os.environ.get('GUNICORN_THREADS', 8))
+
+# Load the app once in the master process and fork the workers from it.
+preload_app = True
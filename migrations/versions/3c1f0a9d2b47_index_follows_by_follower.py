@@ -0,0 +1,26 @@
+"""index follows by follower
+
+Revision ID: 3c1f0a9d2b47
+Revises: 70b4d1f2fb19
+Create Date: 2026-10-15 09:12:31.402117
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3c1f0a9d2b47'
+down_revision = '70b4d1f2fb19'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('follows', schema=None) as batch_op:
+        batch_op.create_index('ix_follows_following', ['user_following_id', 'user_being_followed_id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('follows', schema=None) as batch_op:
+        batch_op.drop_index('ix_follows_following')
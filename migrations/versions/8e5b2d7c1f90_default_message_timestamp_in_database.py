@@ -0,0 +1,32 @@
+"""default message timestamp in database
+
+Revision ID: 8e5b2d7c1f90
+Revises: 3c1f0a9d2b47
+Create Date: 2026-10-15 10:03:47.118254
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8e5b2d7c1f90'
+down_revision = '3c1f0a9d2b47'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('messages', schema=None) as batch_op:
+        batch_op.alter_column('timestamp',
+               existing_type=sa.DateTime(),
+               existing_nullable=False,
+               server_default=sa.text("timezone('utc', now())"))
+
+
+def downgrade():
+    with op.batch_alter_table('messages', schema=None) as batch_op:
+        batch_op.alter_column('timestamp',
+               existing_type=sa.DateTime(),
+               existing_nullable=False,
+               server_default=None)
@@ -0,0 +1,26 @@
+"""index messages by user and timestamp
+
+Revision ID: b41e7c9a0d15
+Revises: 8e5b2d7c1f90
+Create Date: 2026-10-15 10:41:05.927384
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b41e7c9a0d15'
+down_revision = '8e5b2d7c1f90'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('messages', schema=None) as batch_op:
+        batch_op.create_index('ix_messages_user_ts', ['user_id', sa.text('timestamp DESC')], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('messages', schema=None) as batch_op:
+        batch_op.drop_index('ix_messages_user_ts')
@@ -0,0 +1,26 @@
+"""trigram index on usernames
+
+Revision ID: d7a3f5e8c261
+Revises: b41e7c9a0d15
+Create Date: 2026-10-15 11:18:52.604731
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd7a3f5e8c261'
+down_revision = 'b41e7c9a0d15'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    op.create_index('ix_users_username_trgm', 'users', ['username'], unique=False,
+                    postgresql_using='gin', postgresql_ops={'username': 'gin_trgm_ops'})
+
+
+def downgrade():
+    op.drop_index('ix_users_username_trgm', table_name='users')
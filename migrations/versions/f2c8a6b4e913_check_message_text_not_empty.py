@@ -0,0 +1,27 @@
+"""check message text not empty
+
+Revision ID: f2c8a6b4e913
+Revises: d7a3f5e8c261
+Create Date: 2026-10-15 11:52:20.381946
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f2c8a6b4e913'
+down_revision = 'd7a3f5e8c261'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute('ALTER TABLE messages DROP CONSTRAINT IF EXISTS check_text_not_empty')
+    op.create_check_constraint('check_text_not_empty', 'messages',
+                               'char_length(text) > 0 AND char_length(text) <= 140')
+
+
+def downgrade():
+    op.drop_constraint('check_text_not_empty', 'messages', type_='check')
+    op.create_check_constraint('check_text_not_empty', 'messages', 'text IS NOT NULL')
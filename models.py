@@ -1,11 +1,9 @@
 """SQLAlchemy models for Warbler."""
 
-from datetime import datetime
-
 from flask_bcrypt import Bcrypt
 from flask_sqlalchemy import SQLAlchemy
 from flask import session
-from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey
+from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, inspect
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from sqlalchemy.schema import CheckConstraint
@@ -15,7 +13,11 @@ from sqlalchemy.schema import CheckConstraint
 bcrypt = Bcrypt()
 
 # Initialize the SQLAlchemy extension for interacting with the database.
-db = SQLAlchemy()
+# Objects are not expired on commit: a request ends soon after it commits, and most routes that commit
+# then read g.user, to save it in the cache (see update_cached_user in app.py) or to redirect to
+# /users/<g.user.id>. Expiring it would reload the user's row from the database for each of those,
+# even when it came from the cache.
+db = SQLAlchemy(session_options={'expire_on_commit': False})
 
 # Define a model for the follows relationship between users.
 class Follows(db.Model):
@@ -38,6 +40,12 @@ class Follows(db.Model):
         primary_key=True,
     )
 
+    # Add an index on (user_following_id, user_being_followed_id), the reverse of the primary key,
+    # so "who does this user follow" lookups are a single index probe.
+    __table_args__ = (
+        db.Index('ix_follows_following', 'user_following_id', 'user_being_followed_id'),
+    )
+
 # Define a model for the likes relationship between users and messages.
 class Likes(db.Model):
     """Connection of a user <-> liked_message."""
@@ -78,6 +86,8 @@ class User(db.Model):
     )
 
     # Define a column for the username of the user, which is required and must be unique.
+    # The users search also uses a pg_trgm GIN index on it (ix_users_username_trgm), which is created
+    # in its migration rather than here because it needs the pg_trgm extension installed.
     username = db.Column(
         db.Text,
         nullable=False,
@@ -113,23 +123,64 @@ class User(db.Model):
     )
 
     # Define a relationship to the Message model to get the messages of the user.
-    messages = db.relationship('Message')
+    messages = db.relationship('Message', back_populates='user')
 
     # Define a relationship to the User model through the Follows model to get the followers of the user.
+    # followers and following are the two sides of the same follows rows, so pair them with
+    # back_populates; this lets eager-loading options (selectinload) apply to each side cleanly.
     followers = db.relationship(
         "User",
         secondary="follows",
         primaryjoin=(Follows.user_being_followed_id == id),
-        secondaryjoin=(Follows.user_following_id == id)
+        secondaryjoin=(Follows.user_following_id == id),
+        back_populates='following',
     )
     following = db.relationship(
         "User",
         secondary="follows",
         primaryjoin=(Follows.user_following_id == id),
-        secondaryjoin=(Follows.user_being_followed_id == id)
+        secondaryjoin=(Follows.user_being_followed_id == id),
+        back_populates='followers',
     )
 
-    likes = db.relationship('Message', secondary='likes', backref='user_likes')
+    # Define a relationship to the Message model through the Likes model to get the messages the user liked.
+    likes = db.relationship('Message', secondary='likes', back_populates='user_likes')
+
+    # The IDs of the users this user follows and of the messages they liked, as sets.
+    # Each is loaded with one query the first time it's used and kept on the object for the rest of the request.
+    # For g.user they may be set from the cache instead (see get_cached_user in app.py).
+    _following_ids = None
+    _liked_ids = None
+
+    @property
+    def following_ids(self):
+        """IDs of the users this user follows."""
+        if self._following_ids is None:
+            self._following_ids = {
+                followed_id for (followed_id,) in db.session
+                .query(Follows.user_being_followed_id)
+                .filter_by(user_following_id=self.id)
+            }
+        return self._following_ids
+
+    @following_ids.setter
+    def following_ids(self, ids):
+        self._following_ids = set(ids)
+
+    @property
+    def liked_ids(self):
+        """IDs of the messages this user liked."""
+        if self._liked_ids is None:
+            self._liked_ids = {
+                message_id for (message_id,) in db.session
+                .query(Likes.message_id)
+                .filter_by(user_id=self.id)
+            }
+        return self._liked_ids
+
+    @liked_ids.setter
+    def liked_ids(self, ids):
+        self._liked_ids = set(ids)
 
     def __repr__(self):
         return f"<User #{self.id}: {self.username}, {self.email}>"
@@ -137,14 +188,27 @@ class User(db.Model):
     def is_followed_by(self, other_user):
         """Is this user followed by `other_user`?"""
 
-        found_user_list = [user for user in self.followers if user == other_user]
-        return len(found_user_list) == 1
+        # If the followers are already loaded (as they are for g.user), check them in memory.
+        if 'followers' not in inspect(self).unloaded:
+            return other_user in self.followers
+
+        return db.session.query(
+            Follows.query.filter_by(
+                user_being_followed_id=self.id,
+                user_following_id=other_user.id,
+            ).exists()
+        ).scalar()
 
     def is_following(self, other_user):
         """Is this user following `other_use`?"""
 
-        found_user_list = [user for user in self.following if user == other_user]
-        return len(found_user_list) == 1
+        # If the following list is already loaded, check it in memory.
+        if 'following' not in inspect(self).unloaded:
+            return other_user in self.following
+
+        # Otherwise check the IDs of the users this user follows, so a page checking many users
+        # (like the users list) loads them once instead of querying for each user.
+        return other_user.id in self.following_ids
     
     def check_password(self, password):
         """Check password against hashed version."""
@@ -213,11 +277,12 @@ class Message(db.Model):
         nullable=False,
     )
 
-    # Define a column for the timestamp of the message, which defaults to the current time and is required.
+    # Define a column for the timestamp of the message, which is required.
+    # The database fills it in with the current UTC time when a message is inserted.
     timestamp = db.Column(
         db.DateTime,
         nullable=False,
-        default=datetime.utcnow(),
+        server_default=db.text("timezone('utc', now())"),
     )
 
     # Define a column for the ID of the user who posted the message, which is a foreign key to the users table and is required.
@@ -227,13 +292,20 @@ class Message(db.Model):
         nullable=False,
     )
 
-    # Add a check constraint to ensure that the text of the message is not null.
+    # Add a check constraint to ensure that the text of the message is not empty and no more than 140 characters.
+    # Add an index on (user_id, timestamp DESC) so a user's newest messages (on their profile page)
+    # are read in order from the index instead of sorted, and their messages are counted from it.
+    # The feed also finds each followed user's messages through it, though it still sorts them together.
     __table_args__ = (
-        CheckConstraint(text != None, name='check_text_not_empty'),
+        CheckConstraint("char_length(text) > 0 AND char_length(text) <= 140", name='check_text_not_empty'),
+        db.Index('ix_messages_user_ts', 'user_id', timestamp.desc()),
     )
 
     # Define a relationship to the User model to get the user who posted the message.
-    user = db.relationship('User')
+    user = db.relationship('User', back_populates='messages')
+
+    # Define a relationship to the User model through the Likes model to get the users who liked the message.
+    user_likes = db.relationship('User', secondary='likes', back_populates='likes')
 
 # Define a function to connect the database to a Flask app.
 def connect_db(app):
@@ -245,3 +317,6 @@ def connect_db(app):
 
     # Call the init_app method of the db object to complete the connection.
     db.init_app(app)
+
+    # Call the init_app method of the bcrypt object so it uses the app's BCRYPT_LOG_ROUNDS.
+    bcrypt.init_app(app)
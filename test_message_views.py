@@ -1,176 +1,178 @@
-# I'm importing the os module, which allows me to interact with the operating system.
-import os
-# I'm importing TestCase from the unittest module, which provides a framework for creating tests.
-from unittest import TestCase
+# I'm importing pytest to use the shared fixtures from conftest.py.
+import pytest
+# I'm importing the signal Flask sends before rendering a template, and inspect to see what a user has loaded.
+from flask import before_render_template
+from sqlalchemy import inspect
 
-# I'm importing the db, connect_db, Message, and User classes from the models module.
-from models import db, connect_db, Message, User
+# I'm importing the db, connect_db, Message, User, and Follows classes from the models module.
+from models import db, connect_db, Message, User, Follows
 
-# I'm setting an environment variable to specify the database URL for testing.
-# This needs to be done before importing the app, as the app connects to the database upon import.
-os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
-
-# Now that the database URL is set, I can import the app and the current user key.
+# I'm importing the app and the current user key.
+# The test database and the other test settings are set up in conftest.py, before the app is imported.
 from app import app, CURR_USER_KEY
-
-# I'm creating all the tables in the database.
-# This is done here so that the tables are created once for all tests.
-db.create_all()
-
-# I'm disabling CSRF protection in WTForms for testing, as it can be difficult to test.
-app.config['WTF_CSRF_ENABLED'] = False
-
-# I'm defining a test case class for the message views.
-class MessageViewTestCase(TestCase):
-    """Test views for messages."""
-
-    # In the setUp method, I'm setting up the test client and some sample data.
-    def setUp(self):
-        """Create test client, add sample data."""
-
-        # I'm dropping all tables in the database and then creating them again.
-        # This ensures a clean slate for each test.
-        db.drop_all() 
-        db.create_all()  
-
-        # I'm deleting all users and messages from the database.
-        User.query.delete()
-        Message.query.delete()
-
-        # I'm creating a test client, which allows me to send requests to the app within tests.
-        self.client = app.test_client()
-
-        # I'm signing up two users and saving them to the database.
-        self.testuser = User.signup(username="testuser", email="test@test.com", password="testpassword", image_url=None)
-        self.another_user = User.signup(username="anotheruser", email="another@test.com", password="anotherpassword", image_url=None)
-
-        # I'm committing the session to save the new users to the database.
-        db.session.commit()
-
-        # I'm saving the IDs of the two users for later use in tests.
-        self.testuser_id = self.testuser.id
-        self.another_user_id = self.another_user.id
-
-    # In the tearDown method, I'm cleaning up after each test.
-    def tearDown(self):
-        # I'm removing the current session and dropping all tables in the database.
-        db.session.remove()
-        db.drop_all()
-
-    def test_add_message(self):
-        """Can use add a message?"""
-
-        # Since we need to change the session to mimic logging in,
-        # we need to use the changing-session trick:
-
-        with self.client as c:
-            with c.session_transaction() as sess:
-                sess[CURR_USER_KEY] = self.testuser.id
-
-            # Now, that session setting is saved, so we can have
-            # the rest of ours test
-
-            resp = c.post("/messages/new", data={"text": "Hello"})
-
-            # Make sure it redirects
-            self.assertEqual(resp.status_code, 302)
-
-            # I'm querying the database for the message.
-            msg = Message.query.one()
-            # I'm asserting that the text of the message is "Hello".
-            self.assertEqual(msg.text, "Hello")
-
-            # I'm defining a method to log in a user by sending a POST request to the login route with the user's credentials.
-            def login(self):
-                return self.client.post('/login', data=dict(
-                    username='testuser',
-                    password='testpassword'
-                ), follow_redirects=True)
-
-            # I'm defining a method to log out a user by deleting the current user key from the session and sending a GET request to the logout route.
-            def logout(self):
-                with self.client.session_transaction() as sess:
-                    if CURR_USER_KEY in sess:
-                        del sess[CURR_USER_KEY]
-                return self.client.get('/logout', follow_redirects=True)
-
-            # I'm defining a test method to test viewing the followers of a user when logged in.
-            def test_followers_when_logged_in(self):
-                self.login()  # I'm logging in a user.
-                response = self.client.get(f'/users/{self.testuser_id}/followers')  # I'm sending a GET request to the followers route.
-                self.assertEqual(response.status_code, 200)  # I'm asserting that the response status code is 200, which means the request was successful.
-
-            # I'm defining a test method to test viewing the followers of a user when logged out.
-            def test_followers_when_logged_out(self):
-                self.logout()  # I'm logging out the user.
-                response = self.client.get(f'/users/{self.testuser_id}/followers')  # I'm sending a GET request to the followers route.
-                self.assertNotEqual(response.status_code, 200)  # I'm asserting that the response status code is not 200, which means the request was not successful.
-
-            # I'm defining a test method to test adding a message when logged in.
-            def test_add_message_when_logged_in(self):
-                self.login()  # I'm logging in a user.
-                response = self.client.post('/messages/new', data=dict(  # I'm sending a POST request to the "new message" route with the text of the message.
-                    text='Hello, World!'
-                ), follow_redirects=True)
-                self.assertEqual(response.status_code, 200)  # I'm asserting that the response status code is 200, which means the request was successful.
-                self.assertIn(b'Hello, World!', response.data)  # I'm asserting that the text of the message is in the response data.
-
-            # I'm defining a test method to test adding a message when logged out.
-            def test_add_message_when_logged_out(self):
-                self.logout()  # I'm logging out the user.
-                response = self.client.post('/messages/new', data=dict(  # I'm sending a POST request to the "new message" route with the text of the message.
-                    text='Hello, World!'
-                ), follow_redirects=True)
-                self.assertNotEqual(response.status_code, 200)  # I'm asserting that the response status code is not 200, which means the request was not successful.
-
-            # I'm defining a test method to test deleting a message when logged in.
-            def test_delete_message_when_logged_in(self):
-                self.login()  # I'm logging in a user.
-                self.client.post('/messages/new', data=dict(text='Hello, World!'), follow_redirects=True)  # I'm adding a message.
-                message = Message.query.filter(Message.text == 'Hello, World!').first()  # I'm querying the database for the message.
-                response = self.client.post(f'/messages/{message.id}/delete', follow_redirects=True)  # I'm sending a POST request to the delete message route.
-                self.assertEqual(response.status_code, 200)  # I'm asserting that the response status code is 200, which means the request was successful.
-
-    # I'm defining a test method to test deleting a message when logged out.
-    def test_delete_message_when_logged_out(self):
-        self.login()  # I'm logging in a user.
-        self.client.post('/messages/new', data=dict(text='Hello, World!'), follow_redirects=True)  # I'm adding a message.
-        db.session.commit()  # I'm committing the session to save the new message to the database.
-        self.logout()  # I'm logging out the user.
-        message = Message.query.filter(Message.text == 'Hello, World!').first()  # I'm querying the database for the message.
-        response = self.client.post(f'/messages/{message.id}/delete', follow_redirects=True)  # I'm sending a POST request to the delete message route.
-        self.assertNotEqual(response.status_code, 200)  # I'm asserting that the response status code is not 200, which means the request was not successful.
-
-    # I'm defining a test method to test adding a message as another user.
-    def test_add_message_as_another_user(self):
-        with self.client as c:
-            with c.session_transaction() as sess:
-                sess[CURR_USER_KEY] = self.testuser.id  # I'm setting the current user key in the session to the ID of the test user.
-
-            self.logout()  # I'm logging out the user.
-
-            with c.session_transaction() as sess:
-                sess[CURR_USER_KEY] = self.another_user_id  # I'm setting the current user key in the session to the ID of another user.
-
-            response = c.post('/messages/new', data=dict(text='Hello, World!'), follow_redirects=True)  # I'm sending a POST request to the "new message" route with the text of the message.
-
-            self.assertEqual(response.status_code, 200)  # I'm asserting that the response status code is 200, which means the request was successful.
-
-            msg = Message.query.one()  # I'm querying the database for the message.
-            self.assertEqual(msg.text, 'Hello, World!')  # I'm asserting that the text of the message is "Hello, World!".
-            self.assertEqual(msg.user_id, self.another_user_id)  # I'm asserting that the user ID of the message is the ID of another user.
-
-    # I'm defining a test method to test deleting a message as another user.
-    def test_delete_message_as_another_user(self):
-        self.login()  # I'm logging in a user.
-        self.client.post('/messages/new', data=dict(text='Hello, World!'), follow_redirects=True)  # I'm adding a message.
-        db.session.commit()  # I'm committing the session to save the new message to the database.
-        with self.client.session_transaction() as session:
-            session[CURR_USER_KEY] = self.another_user_id  # I'm setting the current user key in the session to the ID of another user.
-        message = Message.query.filter(Message.text == 'Hello, World!').first()  # I'm querying the database for the message.
-        response = self.client.post(f'/messages/{message.id}/delete', follow_redirects=True)  # I'm sending a POST request to the delete message route.
-        self.assertNotEqual(response.status_code, 200)  # I'm asserting that the response status code is not 200, which means the request was not successful.
-
-    # I'm defining the main function to run the tests.
-    if __name__ == '__main__':
-        unittest.main()  # I'm running the tests.
\ No newline at end of file
+# I'm importing the function that logs a test client out from conftest.py.
+from conftest import logout
+
+# I'm running each test in a transaction that is rolled back afterwards, with CSRF protection in WTForms turned off,
+# as it can be difficult to test (see the db_session and no_csrf fixtures in conftest.py).
+pytestmark = pytest.mark.usefixtures("db_session", "no_csrf")
+
+
+# I'm defining a function to log in a user by putting their ID in the session, like the login route does.
+# This skips the login request (and its password check), since these tests aren't about logging in.
+def login_as(client, user_id):
+    with client.session_transaction() as sess:
+        sess[CURR_USER_KEY] = user_id
+
+
+def test_add_message(client, seed_users):
+    """Can use add a message?"""
+    testuser_id, another_user_id = seed_users
+
+    # Since we need to change the session to mimic logging in,
+    # we need to use the changing-session trick:
+
+    with client as c:
+        with c.session_transaction() as sess:
+            sess[CURR_USER_KEY] = testuser_id
+
+        # Now, that session setting is saved, so we can have
+        # the rest of ours test
+
+        resp = c.post("/messages/new", data={"text": "Hello"})
+
+        # Make sure it redirects
+        assert resp.status_code == 302
+
+        # I'm querying the database for the message.
+        msg = Message.query.one()
+        # I'm asserting that the text of the message is "Hello".
+        assert msg.text == "Hello"
+
+
+# I'm defining a test function to test adding a message when logged in.
+def test_add_message_when_logged_in(client, seed_users):
+    testuser_id, another_user_id = seed_users
+    login_as(client, testuser_id)  # I'm logging in a user.
+    response = client.post('/messages/new', data=dict(  # I'm sending a POST request to the "new message" route with the text of the message.
+        text='Hello, World!'
+    ), follow_redirects=True)
+    assert response.status_code == 200  # I'm asserting that the response status code is 200, which means the request was successful.
+    assert b'Hello, World!' in response.data  # I'm asserting that the text of the message is in the response data.
+
+# I'm defining a test function to test adding a message when logged out.
+def test_add_message_when_logged_out(client):
+    logout(client)  # I'm logging out the user.
+    response = client.post('/messages/new', data=dict(  # I'm sending a POST request to the "new message" route with the text of the message.
+        text='Hello, World!'
+    ), follow_redirects=True)
+    assert response.status_code != 200  # I'm asserting that the response status code is not 200, which means the request was not successful.
+
+# I'm defining a test function to test deleting a message when logged in.
+def test_delete_message_when_logged_in(client, seed_users):
+    testuser_id, another_user_id = seed_users
+    login_as(client, testuser_id)  # I'm logging in a user.
+    client.post('/messages/new', data=dict(text='Hello, World!'), follow_redirects=True)  # I'm adding a message.
+    message = Message.query.order_by(Message.id.desc()).first()  # I'm getting the message just added, the one with the highest ID.
+    response = client.post(f'/messages/{message.id}/delete', follow_redirects=True)  # I'm sending a POST request to the delete message route.
+    assert response.status_code == 200  # I'm asserting that the response status code is 200, which means the request was successful.
+
+# I'm defining a test function to test deleting a message when logged out.
+def test_delete_message_when_logged_out(client, seed_users):
+    testuser_id, another_user_id = seed_users
+    login_as(client, testuser_id)  # I'm logging in a user.
+    client.post('/messages/new', data=dict(text='Hello, World!'), follow_redirects=True)  # I'm adding a message.
+    db.session.commit()  # I'm committing the session to save the new message to the database.
+    logout(client)  # I'm logging out the user.
+    message = Message.query.order_by(Message.id.desc()).first()  # I'm getting the message just added, the one with the highest ID.
+    response = client.post(f'/messages/{message.id}/delete', follow_redirects=True)  # I'm sending a POST request to the delete message route.
+    assert response.status_code != 200  # I'm asserting that the response status code is not 200, which means the request was not successful.
+
+# I'm defining a test function to test adding a message as another user.
+def test_add_message_as_another_user(client, seed_users):
+    testuser_id, another_user_id = seed_users
+    with client as c:
+        with c.session_transaction() as sess:
+            sess[CURR_USER_KEY] = testuser_id  # I'm setting the current user key in the session to the ID of the test user.
+
+        logout(c)  # I'm logging out the user.
+
+        with c.session_transaction() as sess:
+            sess[CURR_USER_KEY] = another_user_id  # I'm setting the current user key in the session to the ID of another user.
+
+        response = c.post('/messages/new', data=dict(text='Hello, World!'), follow_redirects=True)  # I'm sending a POST request to the "new message" route with the text of the message.
+
+        assert response.status_code == 200  # I'm asserting that the response status code is 200, which means the request was successful.
+
+        msg = Message.query.one()  # I'm querying the database for the message.
+        assert msg.text == 'Hello, World!'  # I'm asserting that the text of the message is "Hello, World!".
+        assert msg.user_id == another_user_id  # I'm asserting that the user ID of the message is the ID of another user.
+
+# I'm defining a test function to test deleting a message as another user.
+def test_delete_message_as_another_user(client, seed_users):
+    testuser_id, another_user_id = seed_users
+    login_as(client, testuser_id)  # I'm logging in a user.
+    client.post('/messages/new', data=dict(text='Hello, World!'), follow_redirects=True)  # I'm adding a message.
+    db.session.commit()  # I'm committing the session to save the new message to the database.
+    with client.session_transaction() as session:
+        session[CURR_USER_KEY] = another_user_id  # I'm setting the current user key in the session to the ID of another user.
+    message = Message.query.order_by(Message.id.desc()).first()  # I'm getting the message just added, the one with the highest ID.
+    response = client.post(f'/messages/{message.id}/delete', follow_redirects=True)  # I'm sending a POST request to the delete message route.
+    assert response.status_code != 200  # I'm asserting that the response status code is not 200, which means the request was not successful.
+
+
+# I'm testing that another user's followers page runs the same number of queries however many followers they have,
+# so a query per follower (an N+1 query) would fail it.
+def test_followers_query_count(client, seed_users, count_queries):
+    testuser_id, another_user_id = seed_users
+
+    # I'm logging in as another user, who follows the test user, and viewing the test user's followers.
+    login_as(client, another_user_id)
+    db.session.add(Follows(user_being_followed_id=testuser_id, user_following_id=another_user_id))
+    db.session.commit()
+
+    # I'm counting the queries for the followers page with one follower.
+    with count_queries() as queries:
+        response = client.get(f'/users/{testuser_id}/followers')
+    assert response.status_code == 200
+    one_follower = len(queries)
+
+    # I'm adding three more followers and counting the queries again.
+    for i in range(3):
+        follower = User(username=f"follower{i}", email=f"follower{i}@test.com", password="testpassword")
+        follower.following.append(db.session.get(User, testuser_id))
+        db.session.add(follower)
+    db.session.commit()
+
+    with count_queries() as queries:
+        response = client.get(f'/users/{testuser_id}/followers')
+    assert response.status_code == 200
+    assert len(queries) == one_follower
+
+
+# I'm testing that the profile pages load everything the profile header shows before the template runs
+# (the user's messages are counted in SQL instead, so they aren't loaded),
+# both for another user and for the logged in user (who is already in the session as g.user).
+# Lazy loads during rendering would also show up as the same number of queries, so this checks the
+# user passed to the template instead.
+@pytest.mark.parametrize("page", ["", "/followers", "/following"])
+@pytest.mark.parametrize("own_page", [True, False])
+def test_profile_pages_eager_load_user(client, seed_users, page, own_page):
+    testuser_id, another_user_id = seed_users
+    login_as(client, testuser_id)
+    user_id = testuser_id if own_page else another_user_id
+
+    # I'm recording which of the page user's relationships weren't loaded yet when the template started rendering.
+    unloaded = []
+
+    def record(sender, template, context, **extra):
+        unloaded.append(inspect(context['user']).unloaded)
+
+    before_render_template.connect(record, app)
+    try:
+        response = client.get(f'/users/{user_id}{page}')
+    finally:
+        before_render_template.disconnect(record, app)
+
+    assert response.status_code == 200
+    assert unloaded[0].isdisjoint({'following', 'followers', 'likes'})
@@ -2,124 +2,132 @@
 
 # run these tests like:
 #
-#    python -m unittest test_user_model.py
+#    python -m pytest test_user_model.py
 
-import os
-from unittest import TestCase
-from models import db, User, Message, Follows, Likes
-from app import app
+import pytest
+from models import db, bcrypt, User
 
-# BEFORE we import our app, let's set an environmental variable
-# to use a different database for tests (we need to do this
-# before we import our app, since that will have already
-# connected to the database
+# The test database and the other test settings are set up in conftest.py, before the app is imported,
+# and the tables are created once for the whole test run by the _schema fixture there.
 
-os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+# Hash the test password once for the whole module. Tests that need a user with a real password,
+# but aren't testing signup itself, create the user with this hash instead of calling User.signup.
+PASSWORD_HASH = bcrypt.generate_password_hash('testpassword').decode('UTF-8')
 
-# Create our tables (we do this here, so we only create the tables
-# once for all tests --- in each test, we'll delete the data
-# and create fresh new clean test data
+# Each test runs in a SAVEPOINT transaction that is rolled back afterwards
+# (see the db_session fixture in conftest.py), so there's no data to delete before a test.
+# The users here aren't named testuser, since that user is seeded for the view tests.
+pytestmark = pytest.mark.usefixtures("db_session")
 
-db.create_all()
 
-class UserModelTestCase(TestCase):
-    """Test views for messages."""
+def test_user_model():
+    """Does basic model work?"""
 
-    def setUp(self):
-        """Create test client, add sample data."""
+    u = User(
+        email="model@test.com",
+        username="modeluser",
+        password="HASHED_PASSWORD"
+    )
 
-        Likes.query.delete()
-        User.query.delete()
-        Message.query.delete()
-        Follows.query.delete()
+    db.session.add(u)
+    db.session.commit()
 
-        self.client = app.test_client()
-        
-    def tearDown(self):
-        """Clean up fouled transactions."""
+    # User should have no messages & no followers
+    assert len(u.messages) == 0
+    assert len(u.followers) == 0
 
-        db.session.rollback()
 
-    def test_user_model(self):
-        """Does basic model work?"""
+def test_new_user():
+    user = User.signup(username='modeluser', email='model@test.com', password='testpassword', image_url=None)
+    db.session.commit()
 
-        u = User(
-            email="test@test.com",
-            username="testuser",
-            password="HASHED_PASSWORD"
-        )
+    assert user.username == 'modeluser'
+    assert user.email == 'model@test.com'
+    assert user.password != 'testpassword'  # password should be hashed, it should not be equal to the original password
 
-        db.session.add(u)
-        db.session.commit()
 
-        # User should have no messages & no followers
-        self.assertEqual(len(u.messages), 0)
-        self.assertEqual(len(u.followers), 0)
+def test_password_verification():
+    user = User.signup(username='modeluser', email='model@test.com', password='testpassword', image_url=None)
+    db.session.commit()
 
-    def test_new_user(self):
-        user = User.signup(username='testuser', email='test@test.com', password='testpassword', image_url=None)
-        db.session.commit()
+    assert user.check_password('testpassword')  # it should return True for correct password
+    assert not user.check_password('wrongpassword')  # it should return False for incorrect password
 
-        self.assertEqual(user.username, 'testuser')
-        self.assertEqual(user.email, 'test@test.com')
-        self.assertNotEqual(user.password, 'testpassword')  # password should be hashed, it should not be equal to the original password
 
-    def test_password_verification(self):
-        user = User.signup(username='testuser', email='test@test.com', password='testpassword', image_url=None)
-        db.session.commit()
+def test_user_repr():
+    user = User(username='modeluser', email='model@test.com', password=PASSWORD_HASH)
+    db.session.add(user)
+    db.session.commit()
 
-        self.assertTrue(user.check_password('testpassword'))  # it should return True for correct password
-        self.assertFalse(user.check_password('wrongpassword'))  # it should return False for incorrect password
+    assert repr(user) == f'<User #{user.id}: {user.username}, {user.email}>'
 
-    def test_user_repr(self):
-        user = User.signup(username='testuser', email='test@test.com', password='testpassword', image_url=None)
-        db.session.commit()
 
-        self.assertEqual(repr(user), f'<User #{user.id}: {user.username}, {user.email}>')
+def test_is_following():
+    user1 = User(username='testuser1', email='test1@test.com', password='testpassword')
+    user2 = User(username='testuser2', email='test2@test.com', password='testpassword')
+    db.session.add(user1)
+    db.session.add(user2)
+    db.session.commit()
 
-    def test_is_following(self):
-        user1 = User(username='testuser1', email='test1@test.com', password='testpassword')
-        user2 = User(username='testuser2', email='test2@test.com', password='testpassword')
-        db.session.add(user1)
-        db.session.add(user2)
-        db.session.commit()
+    user1.following.append(user2)
+    db.session.commit()
 
-        user1.following.append(user2)
-        db.session.commit()
+    assert user1.is_following(user2)  # it should return True
+    assert not user2.is_following(user1)  # it should return False
+
+
+def test_is_followed_by():
+    user1 = User(username='testuser1', email='test1@test.com', password='testpassword')
+    user2 = User(username='testuser2', email='test2@test.com', password='testpassword')
+    db.session.add(user1)
+    db.session.add(user2)
+    db.session.commit()
+
+    user1.followers.append(user2)
+    db.session.commit()
+
+    assert user1.is_followed_by(user2)  # it should return True
+    assert not user2.is_followed_by(user1)  # it should return False
 
-        self.assertTrue(user1.is_following(user2))  # it should return True
-        self.assertFalse(user2.is_following(user1))  # it should return False
 
-    def test_is_followed_by(self):
-        user1 = User(username='testuser1', email='test1@test.com', password='testpassword')
-        user2 = User(username='testuser2', email='test2@test.com', password='testpassword')
-        db.session.add(user1)
-        db.session.add(user2)
+def test_user_create_with_invalid_credentials():
+    """Does User.create fail to create a new user if any of the validations (e.g. uniqueness, non-nullable fields) fail?"""
+
+    db.session.add(User(username='modeluser', email='model@test.com', password=PASSWORD_HASH))
+    db.session.commit()
+
+    invalid_user = User.signup(username='modeluser', email='test2@test.com', password='testpassword', image_url=None)
+    with pytest.raises(Exception):  # it should raise an exception because the username is not unique
         db.session.commit()
 
-        user1.followers.append(user2)
+    invalid_user = User.signup(username=None, email='test3@test.com', password='testpassword', image_url=None)
+    with pytest.raises(Exception):  # it should raise an exception because the username is None
         db.session.commit()
 
-        self.assertTrue(user1.is_followed_by(user2))  # it should return True
-        self.assertFalse(user2.is_followed_by(user1))  # it should return False
-    def test_user_create_with_invalid_credentials(self):
-        """Does User.create fail to create a new user if any of the validations (e.g. uniqueness, non-nullable fields) fail?"""
 
-        User.signup(username='testuser', email='test@test.com', password='testpassword', image_url=None)
-        db.session.commit()
+def test_user_authenticate_with_invalid_username():
+    """Does User.authenticate fail to return a user when the username is invalid?"""
 
-        invalid_user = User.signup(username='testuser', email='test2@test.com', password='testpassword', image_url=None)
-        with self.assertRaises(Exception):  # it should raise an exception because the username is not unique
-            db.session.commit()
+    db.session.add(User(username='modeluser', email='model@test.com', password=PASSWORD_HASH))
+    db.session.commit()
 
-        invalid_user = User.signup(username=None, email='test3@test.com', password='testpassword', image_url=None)
-        with self.assertRaises(Exception):  # it should raise an exception because the username is None
-            db.session.commit()
+    assert not User.authenticate(username='invalidusername', password='testpassword')  # it should return False because the username is invalid
 
-    def test_user_authenticate_with_invalid_username(self):
-        """Does User.authenticate fail to return a user when the username is invalid?"""
 
-        User.signup(username='testuser', email='test@test.com', password='testpassword', image_url=None)
-        db.session.commit()
+def test_user_authenticate_success():
+    """Does User.authenticate return the user when given a valid username and password?"""
+
+    user = User(username='modeluser', email='model@test.com', password=PASSWORD_HASH)
+    db.session.add(user)
+    db.session.commit()
+
+    assert User.authenticate(username='modeluser', password='testpassword') == user  # it should return the user
+
+
+def test_user_authenticate_with_invalid_password():
+    """Does User.authenticate fail to return a user when the password is invalid?"""
+
+    db.session.add(User(username='modeluser', email='model@test.com', password=PASSWORD_HASH))
+    db.session.commit()
 
-        self.assertFalse(User.authenticate(username='invalidusername', password='testpassword'))  # it should return False because the username is invalid
\ No newline at end of file
+    assert not User.authenticate(username='modeluser', password='invalidpassword')  # it should return False because the password is invalid
@@ -1,172 +1,386 @@
-import os
-from unittest import TestCase
-from models import db, connect_db, User
-
-# I'm setting the environment variable for the database URL to use the test database.
-os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+from collections import namedtuple
+from types import SimpleNamespace
+import pytest
+from flask import g, session
+from sqlalchemy import inspect
+from models import db, connect_db, User, Message, Follows, Likes
 
 # I'm importing the app and the current user key from the app module.
-from app import app, CURR_USER_KEY
-
-# I'm disabling CSRF protection for the tests.
-app.config['WTF_CSRF_ENABLED'] = False
-
-# I'm defining a test case for user views.
-class UserViewTestCase(TestCase):
-    """Test views for users."""
-
-    # I'm defining the setup method to create a test client and add sample data.
-    def setUp(self):
-        """Create test client, add sample data."""
-
-        # I'm dropping all tables in the database and creating them again.
-        db.drop_all() 
-        db.create_all()  
-
-        # I'm deleting all users from the database.
-        User.query.delete()
-
-        # I'm creating a test client.
-        self.client = app.test_client()
-
-        # I'm signing up two users and saving them to the database.
-        self.testuser = User.signup(username="testuser", email="test@test.com", password="testpassword", image_url=None)
-        self.another_user = User.signup(username="anotheruser", email="another@test.com", password="anotherpassword", image_url=None)
-
-        # I'm committing the session to save the new users to the database.
-        db.session.commit()
-
-        # I'm storing the IDs of the users for later use.
-        self.testuser_id = self.testuser.id
-        self.another_user_id = self.another_user.id
-
-    # I'm defining the teardown method to clean up after each test.
-    def tearDown(self):
-        # I'm removing the current session and dropping all tables in the database.
-        db.session.remove()
-        db.drop_all()
-
-    # I'm defining a method to log in a user by sending a POST request to the login route with the user's credentials.
-    def login(self):
-        return self.client.post('/login', data=dict(
-            username='testuser',
-            password='testpassword'
-        ), follow_redirects=True)
-
-    # I'm defining a method to log out a user by deleting the current user key from the session and sending a GET request to the logout route.
-    def logout(self):
-        with self.client.session_transaction() as sess:
-            if CURR_USER_KEY in sess:
-                del sess[CURR_USER_KEY]
-        return self.client.get('/logout', follow_redirects=True)
-
-    # I'm defining a test method to test user signup.
-    def test_user_signup(self):
-        with self.client as c:
-            # I'm sending a POST request to the signup route with the new user's data.
-            response = c.post('/signup', data=dict(
-                username='newuser',
-                email='new@test.com',
-                password='newpassword',
-                image_url=None
-            ), follow_redirects=True)
-
-            # I'm asserting that the response status code is 200, which means the request was successful.
-            self.assertEqual(response.status_code, 200)
-
-            # I'm querying the database for the new user.
-            user = User.query.filter_by(username='newuser').first()
-
-            # I'm asserting that the new user exists in the database.
-            self.assertIsNotNone(user)
-
-    # I'm defining a test method to test user login.
-    def test_user_login(self):
-        with self.client as c:
-            # I'm logging in a user.
-            response = self.login()
-
-            # I'm asserting that the response status code is 200, which means the request was successful.
-            self.assertEqual(response.status_code, 200)
-
-    # I'm defining a test method to test user logout.
-    def test_user_logout(self):
-        with self.client as c:
-            # I'm logging in a user.
-            self.login()
-
-            # I'm logging out the user.
-            response = self.logout()
-
-            # I'm asserting that the response status code is 200, which means the request was successful.
-            self.assertEqual(response.status_code, 200)
-
-    # I'm defining a test method to test viewing the followers of a user when logged in.
-    def test_user_followers_when_logged_in(self):
-        # I'm logging in a user.
-        self.login()
+# The test database (one per worker when run with pytest -n auto) and the other test settings
+# are set up in conftest.py, before the app is imported.
+from app import app, cache, CURR_USER_KEY, add_user_to_g
+# I'm importing the function that logs a test client out from conftest.py.
+from conftest import logout
 
-        # I'm sending a GET request to the followers route.
-        response = self.client.get(f'/users/{self.testuser_id}/followers') 
+# I'm turning off CSRF protection for the tests in this module (see the no_csrf fixture in conftest.py).
+pytestmark = pytest.mark.usefixtures("no_csrf")
 
-        # I'm asserting that the response status code is 200, which means the request was successful.
-        self.assertEqual(response.status_code, 200)
+# I'm defining a named tuple for the IDs of the two seeded users, and the URLs of testuser's pages.
+Users = namedtuple('Users', ['testuser_id', 'another_user_id', 'urls'])
 
-    # I'm defining a test method to test viewing the followers of a user when logged out.
-    def test_user_followers_when_logged_out(self):
-        # I'm logging out the user.
-        self.logout()
 
-        # I'm sending a GET request to the followers route.
-        response = self.client.get(f'/users/{self.testuser_id}/followers')
+# I'm defining a fixture that gives a test the IDs of the two users seeded once for the whole test run (see seed_users in conftest.py).
+# Each test runs in a transaction that is rolled back afterwards (see the db_session fixture in conftest.py),
+# so the tables are created once for the whole test run instead of being dropped and created for every test.
+@pytest.fixture
+def users(db_session, seed_users):
+    """Give the test the IDs of testuser and anotheruser, and the URLs of testuser's pages."""
 
-        # I'm asserting that the response status code is not 200, which means the request was not successful.
-        self.assertNotEqual(response.status_code, 200)
+    testuser_id, another_user_id = seed_users
+    urls = SimpleNamespace(
+        followers=f"/users/{testuser_id}/followers",
+        following=f"/users/{testuser_id}/following",
+        profile=f"/users/{testuser_id}",
+    )
+    return Users(testuser_id, another_user_id, urls)
 
-    # I'm defining a test method to test viewing the users a user is following when logged in.
-    def test_user_following_when_logged_in(self):
-        # I'm logging in a user.
-        self.login()
 
-        # I'm sending a GET request to the following route.
-        response = self.client.get(f'/users/{self.testuser_id}/following') 
+# I'm defining a function to log in a user by sending a POST request to the login route with the user's credentials.
+def login(client):
+    return client.post('/login', data=dict(
+        username='testuser',
+        password='testpassword'
+    ))
 
-        # I'm asserting that the response status code is 200, which means the request was successful.
-        self.assertEqual(response.status_code, 200)
 
-    # I'm defining a test method to test viewing the users a user is following when logged out.
-    def test_user_following_when_logged_out(self):
-        # I'm logging out the user.
-        self.logout()
+# I'm defining a fixture that gives a test the client with testuser logged in.
+# It puts their ID in the session directly, like the login route does, instead of posting to /login:
+# only test_user_login and test_feed_sees_follows_from_another_session log in through the form, with login().
+@pytest.fixture
+def logged_in_client(client, users):
+    """Give the test the test client, logged in as testuser."""
 
-        # I'm sending a GET request to the following route.
-        response = self.client.get(f'/users/{self.testuser_id}/following')
+    with client.session_transaction() as sess:
+        sess[CURR_USER_KEY] = users.testuser_id
+    return client
 
-        # I'm asserting that the response status code is not 200, which means the request was not successful.
-        self.assertNotEqual(response.status_code, 200)
 
-    # I'm defining a test method to test viewing a user's profile when logged in.
-    def test_user_profile_when_logged_in(self):
-        # I'm logging in a user.
-        self.login()
+# I'm defining a fixture that gives a test the client with no one logged in.
+# The client fixture (see conftest.py) has already cleared its cookies, so there's nothing to log out of.
+@pytest.fixture
+def logged_out_client(client, users):
+    """Give the test the test client, logged out."""
 
-        # I'm sending a GET request to the user's profile route.
-        response = self.client.get(f'/users/{self.testuser_id}') 
+    return client
 
-        # I'm asserting that the response status code is 200, which means the request was successful.
-        self.assertEqual(response.status_code, 200)
 
-    # I'm defining a test method to test viewing a user's profile when logged out.
-    def test_user_profile_when_logged_out(self):
-        # I'm logging out the user.
-        self.logout()
+# I'm defining a fixture that swaps the cache (NullCache in tests, see conftest.py) for an empty SimpleCache,
+# so a test can check what the app does when the logged in user is served from the cache.
+@pytest.fixture
+def simple_cache():
+    """Give the test an empty in-memory cache, and put the usual one back afterwards."""
+
+    cache.init_app(app, config={'CACHE_TYPE': 'SimpleCache'})
+    yield cache
+    cache.init_app(app)
+
+
+# I'm defining a fixture that points the cache at a Redis server that isn't there, so every cache call fails.
+@pytest.fixture
+def unreachable_cache():
+    """Give the test a Redis cache that can't be reached, and put the usual one back afterwards."""
 
-        # I'm sending a GET request to the user's profile route.
-        response = self.client.get(f'/users/{self.testuser_id}')
+    cache.init_app(app, config={'CACHE_TYPE': 'RedisCache', 'CACHE_REDIS_URL': 'redis://localhost:1/0'})
+    yield cache
+    cache.init_app(app)
 
-        # I'm asserting that the response status code is not 200, which means the request was not successful.
-        self.assertNotEqual(response.status_code, 200)
 
-    # I'm checking if this script is the main module and, if so, running the tests.
-    if __name__ == '__main__':
-        unittest.main()
\ No newline at end of file
+# I'm defining a test function to test user signup.
+def test_user_signup(client, users):
+    with client as c:
+        # I'm sending a POST request to the signup route with the new user's data.
+        response = c.post('/signup', data=dict(
+            username='newuser',
+            email='new@test.com',
+            password='newpassword',
+            image_url=None
+        ))
+
+        # I'm asserting that the response status code is 302, which means the user was signed up and redirected to the homepage.
+        assert response.status_code == 302
+
+        # I'm querying the database for the new user.
+        user = User.query.filter_by(username='newuser').first()
+
+        # I'm asserting that the new user exists in the database.
+        assert user is not None
+
+
+# I'm defining a test function to test user login.
+def test_user_login(client, users):
+    with client as c:
+        # I'm logging in a user.
+        response = login(c)
+
+        # I'm asserting that the response status code is 302, which means the user was logged in and redirected to the homepage.
+        assert response.status_code == 302
+
+
+# I'm defining a test function to test user logout.
+def test_user_logout(logged_in_client):
+    with logged_in_client as c:
+        # I'm logging out the user.
+        response = logout(c)
+
+        # I'm asserting that the response status code is 302, which means the user was logged out and redirected to the homepage.
+        assert response.status_code == 302
+
+
+# I'm defining a test function to test viewing a user's followers, the users they are following, and their profile,
+# both logged in and logged out.
+@pytest.mark.parametrize("page", ["followers", "following", "profile"])
+@pytest.mark.parametrize("logged_in", [True, False])
+def test_user_pages(request, users, page, logged_in):
+    # I'm getting the logged in or logged out client.
+    client = request.getfixturevalue("logged_in_client" if logged_in else "logged_out_client")
+
+    # I'm sending a GET request to the user's page.
+    response = client.get(getattr(users.urls, page))
+
+    # I'm asserting that the request was successful (status code 200) only when logged in.
+    assert (response.status_code == 200) == logged_in
+
+
+# I'm defining a test function to test that the logged in user's IDs of the users they follow and the messages
+# they liked are only loaded when used (there's no cache in tests), and without other users' rows.
+def test_add_user_to_g_loads_following_and_liked_ids(users, count_queries):
+    # I'm making the test user follow another user.
+    db.session.add(Follows(user_being_followed_id=users.another_user_id, user_following_id=users.testuser_id))
+    db.session.commit()
+
+    # I'm starting from a fresh session, like every real request does.
+    db.session.remove()
+
+    with app.test_request_context():
+        # I'm putting the user in the session and loading them onto g like a real request would.
+        session[CURR_USER_KEY] = users.testuser_id
+        with count_queries() as queries:
+            add_user_to_g()
+
+        # I'm asserting that only the user's row was loaded.
+        assert len(queries) == 1
+
+        # I'm asserting that the IDs the templates use are loaded when used, once each.
+        with count_queries() as queries:
+            assert g.user.following_ids == {users.another_user_id}
+            assert g.user.liked_ids == set()
+            assert g.user.following_ids == {users.another_user_id}
+        assert len(queries) == 2
+
+        # I'm asserting that the followed users' rows weren't loaded along with them.
+        assert 'following' in inspect(g.user).unloaded
+
+
+# I'm defining a test function to test that following, unfollowing and liking update the cached user
+# in place, so the next request is served from the cache instead of loading the user again.
+def test_cached_user_updated_in_place(client, users, simple_cache, count_queries):
+    message = Message(text='Hello from another user', user_id=users.another_user_id)
+    db.session.add(message)
+    db.session.commit()
+    message_id = message.id
+
+    # I'm loading the homepage as the test user, which caches them.
+    with client.session_transaction() as sess:
+        sess[CURR_USER_KEY] = users.testuser_id
+    client.get('/')
+
+    # I'm following the other user and liking their message.
+    client.post(f'/users/follow/{users.another_user_id}')
+    client.post(f'/users/toggle_like/{message_id}')
+
+    # I'm asserting that the cached user has the new IDs.
+    data = simple_cache.get(f"user:{users.testuser_id}")
+    assert data['following_ids'] == [users.another_user_id]
+    assert data['liked_ids'] == [message_id]
+
+    # I'm unfollowing the other user and unliking their message, and the cached user has the IDs removed.
+    client.post(f'/users/stop-following/{users.another_user_id}')
+    client.post(f'/users/toggle_like/{message_id}')
+    data = simple_cache.get(f"user:{users.testuser_id}")
+    assert data['following_ids'] == []
+    assert data['liked_ids'] == []
+
+    # I'm asserting that the next page doesn't load the user from the database.
+    with count_queries() as queries:
+        client.get('/users/profile')
+    assert queries == []
+
+
+# I'm defining a test function to test that a user served from the cache doesn't show other users' old data.
+# The test user follows another user, who renames themselves; the test user should see the new name.
+def test_cached_user_sees_other_users_changes(client, users, simple_cache):
+    db.session.add(Follows(user_being_followed_id=users.another_user_id, user_following_id=users.testuser_id))
+    db.session.commit()
+
+    # I'm loading pages as the test user, which caches them.
+    with client.session_transaction() as sess:
+        sess[CURR_USER_KEY] = users.testuser_id
+    assert client.get(f'/users/{users.another_user_id}').status_code == 200
+    assert simple_cache.get(f"user:{users.testuser_id}") is not None
+
+    # I'm renaming the other user, logged in as them.
+    with client.session_transaction() as sess:
+        sess[CURR_USER_KEY] = users.another_user_id
+    response = client.post('/users/profile', data=dict(
+        username='renameduser',
+        email='another@test.com',
+        password='anotherpassword',
+    ))
+    assert response.status_code == 302
+
+    # I'm asserting that the test user, served from the cache again, sees the new name.
+    with client.session_transaction() as sess:
+        sess[CURR_USER_KEY] = users.testuser_id
+    assert b'@renameduser' in client.get(f'/users/{users.another_user_id}').data
+    assert b'@renameduser' in client.get(users.urls.following).data
+
+
+# I'm defining a test function to test that the homepage feed follows changes made from another browser.
+def test_feed_sees_follows_from_another_session(client, users):
+    # I'm adding a message from another user.
+    db.session.add(Message(text='Hello from another user', user_id=users.another_user_id))
+    db.session.commit()
+
+    with client as c:
+        # I'm logging in, and the other user's message isn't in the feed since the user follows no one yet.
+        login(c)
+        assert b'Hello from another user' not in c.get('/').data
+
+        # I'm following the other user from a second client, like a second browser would.
+        other_browser = app.test_client()
+        with other_browser.session_transaction() as sess:
+            sess[CURR_USER_KEY] = users.testuser_id
+        other_browser.post(f'/users/follow/{users.another_user_id}')
+
+        # I'm asserting that the first browser's feed now has the other user's message.
+        assert b'Hello from another user' in c.get('/').data
+
+        # I'm asserting that nothing but the user's ID is kept in the session cookie.
+        assert 'following_ids' not in session
+
+
+# I'm defining a test function to test that views marked @no_auth don't load the logged in user.
+def test_add_user_to_g_skips_no_auth_views(users):
+    with app.test_request_context('/login'):
+        # I'm putting the user in the session, but the login page shouldn't look them up.
+        session[CURR_USER_KEY] = users.testuser_id
+        add_user_to_g()
+
+        # I'm asserting that g.user was left empty.
+        assert g.user is None
+
+
+# I'm defining a test function to test that the app keeps working, from the database, when the cache is down.
+def test_app_works_without_cache(client, users, unreachable_cache):
+    with client as c:
+        # I'm logging in, which also clears the user's cached copy.
+        assert login(c).status_code == 302
+
+        # I'm following another user and loading the homepage and the users list.
+        assert c.post(f'/users/follow/{users.another_user_id}').status_code == 302
+        assert c.get('/').status_code == 200
+        assert c.get('/users').status_code == 200
+        assert session[CURR_USER_KEY] == users.testuser_id
+
+
+# I'm defining a test function to test that liking a message twice likes it and then unlikes it.
+def test_toggle_like(logged_in_client, users):
+    # I'm adding a message from another user.
+    message = Message(text='Hello from another user', user_id=users.another_user_id)
+    db.session.add(message)
+    db.session.commit()
+    message_id = message.id
+
+    # I'm asserting that the first POST likes the message.
+    assert logged_in_client.post(f'/users/toggle_like/{message_id}').status_code == 302
+    assert Likes.query.filter_by(user_id=users.testuser_id, message_id=message_id).count() == 1
+
+    # I'm asserting that the second POST unlikes it.
+    assert logged_in_client.post(f'/users/toggle_like/{message_id}').status_code == 302
+    assert Likes.query.filter_by(user_id=users.testuser_id, message_id=message_id).count() == 0
+
+
+# I'm defining a test function to test that liking a message that doesn't exist is a 404, not a 500.
+def test_toggle_like_missing_message(logged_in_client, users):
+    # I'm asserting that the foreign key rejects the like and the response is a 404.
+    assert logged_in_client.post('/users/toggle_like/999999').status_code == 404
+
+    # I'm asserting that the session was rolled back, so the next request still works.
+    assert Likes.query.count() == 0
+    assert logged_in_client.get('/').status_code == 200
+
+
+# I'm defining a test function to test that a user can stop following another user.
+def test_stop_following(logged_in_client, users):
+    # I'm making the test user follow another user.
+    db.session.add(Follows(user_being_followed_id=users.another_user_id, user_following_id=users.testuser_id))
+    db.session.commit()
+
+    # I'm asserting that stopping following deletes the follows row and redirects to the following page.
+    response = logged_in_client.post(f'/users/stop-following/{users.another_user_id}')
+    assert response.status_code == 302
+    assert response.location.endswith(users.urls.following)
+    assert Follows.query.filter_by(user_following_id=users.testuser_id).count() == 0
+
+
+# I'm defining a test function to test that following a user who doesn't exist flashes a message instead of failing.
+def test_follow_missing_user(logged_in_client, users):
+    # I'm asserting that the foreign key rejects the follow and the user is redirected to their following page.
+    response = logged_in_client.post('/users/follow/999999')
+    assert response.status_code == 302
+    assert response.location.endswith(users.urls.following)
+
+    # I'm asserting that the error was flashed and no follows row was added.
+    with logged_in_client.session_transaction() as sess:
+        assert ('danger', 'User not found.') in sess['_flashes']
+    assert Follows.query.filter_by(user_following_id=users.testuser_id).count() == 0
+
+
+# I'm defining a test function to test that the cached anonymous homepage is never served to a logged in user.
+def test_page_cache_skips_logged_in_users(client, users, simple_cache):
+    # I'm loading the homepage logged out, which caches the anonymous page.
+    assert b'New to Warbler?' in client.get('/').data
+
+    # I'm asserting that a logged in user gets their own homepage instead.
+    with client.session_transaction() as sess:
+        sess[CURR_USER_KEY] = users.testuser_id
+    response = client.get('/')
+    assert b'New to Warbler?' not in response.data
+    assert b'@testuser' in response.data
+
+
+# I'm defining a test function to test that a request with flash messages waiting isn't served the cached page,
+# and that its page (which shows the messages) isn't cached for everyone else.
+@pytest.mark.parametrize("url", ["/", "/users"])
+def test_page_cache_skips_pending_flashes(client, users, simple_cache, url):
+    # I'm loading the page logged out, which caches it.
+    assert client.get(url).status_code == 200
+
+    # I'm asserting that a request with a flash message waiting gets a fresh page showing the message.
+    with client.session_transaction() as sess:
+        sess['_flashes'] = [('success', 'Flash for this browser only')]
+    assert b'Flash for this browser only' in client.get(url).data
+
+    # I'm asserting that another browser doesn't see the message.
+    assert b'Flash for this browser only' not in app.test_client().get(url).data
+
+
+# I'm defining a test function to test that the cached users list shows new users and profile edits.
+# Clearing the session logs the user out without the logout route's flash message, which would skip the cache.
+def test_page_cache_invalidates_users_list(client, users, simple_cache):
+    # I'm loading the users list logged out, which caches it.
+    assert b'@newuser' not in client.get('/users').data
+
+    # I'm signing up a new user, and the users list shows them.
+    client.post('/signup', data=dict(username='newuser', email='new@test.com', password='newpassword'))
+    with client.session_transaction() as sess:
+        sess.clear()
+    assert b'@newuser' in client.get('/users').data
+
+    # I'm renaming the test user, logged in as them, and the users list shows the new name.
+    with client.session_transaction() as sess:
+        sess[CURR_USER_KEY] = users.testuser_id
+    client.post('/users/profile', data=dict(username='renameduser', email='test@test.com', password='testpassword'))
+    with client.session_transaction() as sess:
+        sess.clear()
+    assert b'@renameduser' in client.get('/users').data